@@ -29,7 +29,8 @@ import pandas as pd
 import json
 
 from open_ephys.analysis.recording import Recording
-from open_ephys.analysis.utils import alphanum_key
+from open_ephys.analysis.formats.helpers import scale_samples
+from open_ephys.analysis.utils import alphanum_key, find_subdirectories, list_directory
 
 class BinaryRecording(Recording):
     
@@ -49,20 +50,37 @@ class BinaryRecording(Recording):
                 self.sample_numbers = np.load(os.path.join(directory, 'sample_numbers.npy'), mmap_mode='r')
                 self.timestamps = np.load(os.path.join(directory, 'timestamps.npy'), mmap_mode='r')
                 self.electrodes = np.load(os.path.join(directory, 'electrode_indices.npy'), mmap_mode='r') - 1
-                self.waveforms = np.load(os.path.join(directory, 'waveforms.npy')).astype('float64')
+                self._waveforms_file = os.path.join(directory, 'waveforms.npy')
                 self.clusters = np.load(os.path.join(directory, 'clusters.npy'), mmap_mode='r')
 
             else:
                 directory = os.path.join(base_directory, 'spikes', info['folder_name'])
                 self.sample_numbers = np.load(os.path.join(directory, 'spike_times.npy'), mmap_mode='r')
                 self.electrodes = np.load(os.path.join(directory, 'spike_electrode_indices.npy'), mmap_mode='r') - 1
-                self.waveforms = np.load(os.path.join(directory, 'spike_waveforms.npy')).astype('float64')
+                self._waveforms_file = os.path.join(directory, 'spike_waveforms.npy')
                 self.clusters = np.load(os.path.join(directory, 'spike_clusters.npy'), mmap_mode='r')
 
-            if self.waveforms.ndim == 2:
-                self.waveforms = np.expand_dims(self.waveforms, 1)
+            self._bit_volts = float(info['source_channels'][0]['bit_volts'])
 
-            self.waveforms *= float(info['source_channels'][0]['bit_volts'])
+            # waveforms are only read and scaled when they are first needed
+            self._waveforms = None
+
+        @property
+        def waveforms(self):
+            if self._waveforms is None:
+                # the file is mapped rather than read, so the scaled float64
+                # array is the only copy of the waveforms held in memory
+                waveforms = np.load(self._waveforms_file, mmap_mode='r')
+
+                if waveforms.ndim == 2:
+                    waveforms = np.expand_dims(waveforms, 1)
+
+                self._waveforms = np.multiply(waveforms, self._bit_volts, dtype='float64')
+            return self._waveforms
+
+        @waveforms.setter
+        def waveforms(self, waveforms):
+            self._waveforms = waveforms
     
     class Continuous:
         
@@ -92,6 +110,7 @@ class BinaryRecording(Recording):
 
             self.metadata['channel_names'] = [ch['channel_name'] for ch in info['channels']]
             self.metadata['bit_volts'] = [ch['bit_volts'] for ch in info['channels']]
+            self._bit_volts = np.asarray(self.metadata['bit_volts'], dtype='float64')
 
             data = np.memmap(os.path.join(directory, 'continuous.dat'), mode='r', dtype='int16')
             self.samples = data.reshape((len(data) // self.metadata['num_channels'], 
@@ -133,12 +152,9 @@ class BinaryRecording(Recording):
             if selected_channels is None:
                 selected_channels = np.arange(self.metadata['num_channels'])
 
-            samples = self.samples[start_sample_index:end_sample_index, selected_channels].astype('float64')
-
-            for idx, channel in enumerate(selected_channels):
-                samples[:,idx] = samples[:,idx] * self.metadata['bit_volts'][channel]
-
-            return samples
+            return scale_samples(self.samples[start_sample_index:end_sample_index],
+                                 selected_channels,
+                                 self._bit_volts)
     
     def __init__(self, directory, experiment_index=0, recording_index=0, mmap_timestamps=True):
         
@@ -163,6 +179,22 @@ class BinaryRecording(Recording):
             else:
                 self._continuous.append(c)
             
+    def load_stream_metadata(self):
+
+        self._stream_metadata = {}
+
+        for info in self.info['continuous']:
+
+            if self._version >= 0.6:
+                stream_name = info['stream_name']
+            else:
+                stream_name = str(info['source_processor_sub_idx'])
+
+            self._stream_metadata[(info['source_processor_id'], stream_name)] = \
+                {'source_node_name' : info['source_processor_name'],
+                 'sample_rate' : info['sample_rate'],
+                 'num_channels' : info['num_channels']}
+        
     def load_spikes(self):
         
         self._spikes = []
@@ -172,16 +204,17 @@ class BinaryRecording(Recording):
 
     
     def load_events(self):
-        search_string = os.path.join(self.directory,
-                                    'events',
-                                    '*',
-                                    'TTL*')
-        
-        events_directories = glob.glob(search_string)
+        events_directories = []
+
+        for node_directory in find_subdirectories(os.path.join(self.directory, 'events')):
+            events_directories.extend(find_subdirectories(node_directory, 'TTL'))
         
         df = []
         
         streamIdx = -1
+
+        # columns are copied into the events table below, so mapping them avoids an intermediate copy
+        mmap_mode = 'r' if self.mmap_timestamps else None
         
         for events_directory in events_directories:
             
@@ -194,24 +227,30 @@ class BinaryRecording(Recording):
             
             if self._version >= 0.6:
                 channels = np.load(os.path.join(events_directory, 'states.npy'))
-                sample_numbers = np.load(os.path.join(events_directory, 'sample_numbers.npy'))
-                timestamps = np.load(os.path.join(events_directory, 'timestamps.npy'))
+                sample_numbers = np.load(os.path.join(events_directory, 'sample_numbers.npy'), mmap_mode=mmap_mode)
+                timestamps = np.load(os.path.join(events_directory, 'timestamps.npy'), mmap_mode=mmap_mode)
             else:
                 channels = np.load(os.path.join(events_directory, 'channel_states.npy'))
-                sample_numbers = np.load(os.path.join(events_directory, 'timestamps.npy'))
+                sample_numbers = np.load(os.path.join(events_directory, 'timestamps.npy'), mmap_mode=mmap_mode)
                 timestamps = np.ones(sample_numbers.shape) * -1
+
+            # state is taken before the sign is dropped in place to get the line
+            state = (channels > 0).view('int8')
+            line = np.abs(channels, out=channels).astype('int16', copy=False)
         
-            df.append(pd.DataFrame(data = {'line' : np.abs(channels),
+            df.append(pd.DataFrame(data = {'line' : line,
                               'sample_number' : sample_numbers,
                               'timestamp' : timestamps,
-                              'processor_id' : [nodeId] * len(channels),
-                              'stream_index' : [streamIdx] * len(channels),
-                              'stream_name' : [stream] * len(channels),
-                              'state' : (channels > 0).astype('int')}))
+                              'processor_id' : np.full(len(channels), nodeId, dtype='int32'),
+                              'stream_index' : np.full(len(channels), streamIdx, dtype='int16'),
+                              'stream_name' : np.full(len(channels), stream),
+                              'state' : state}))
             
         if len(df) > 0:
 
-            self._events = pd.concat(df)
+            self._events = pd.concat(df, copy=False, ignore_index=True)
+
+            self._events['stream_name'] = self._events['stream_name'].astype('category')
 
             if self.sort_events:
                 if self._version >= 0.6:                  
@@ -254,7 +293,7 @@ class BinaryRecording(Recording):
                 sample_numbers = np.load(os.path.join(msg_center_dir, 'timestamps.npy'))
                 timestamps = np.zeros(sample_numbers.shape) * -1
 
-            text = [msg.decode('utf-8') for msg in np.load(os.path.join(msg_center_dir, 'text.npy'))]
+            text = np.char.decode(np.load(os.path.join(msg_center_dir, 'text.npy')), 'utf-8')
 
             df = pd.DataFrame(data = { 'sample_number' : sample_numbers,
                     'timestamp' : timestamps,
@@ -293,25 +332,28 @@ class BinaryRecording(Recording):
     #####################################################################
     
     @staticmethod
-    def detect_format(directory):
-        binary_files = glob.glob(os.path.join(directory, 'experiment*', 'recording*'))
-        
-        if len(binary_files) > 0:
-            return True
-        else:
-            return False
+    def detect_format(directory, entries=None):
+        if entries is None:
+            entries = list_directory(directory)
+
+        for name in entries:
+            if name.startswith('experiment') and \
+               len(glob.glob(os.path.join(directory, name, 'recording*'))) > 0:
+                return True
+
+        return False
     
     @staticmethod
     def detect_recordings(directory, mmap_timestamps=True):
         
         recordings = []
         
-        experiment_directories = glob.glob(os.path.join(directory, 'experiment*'))
+        experiment_directories = find_subdirectories(directory, 'experiment')
         experiment_directories.sort(key=alphanum_key)
 
         for experiment_index, experiment_directory in enumerate(experiment_directories):
              
-            recording_directories = glob.glob(os.path.join(experiment_directory, 'recording*'))
+            recording_directories = find_subdirectories(experiment_directory, 'recording')
             recording_directories.sort(key=alphanum_key)
             
             for recording_index, recording_directory in enumerate(recording_directories):
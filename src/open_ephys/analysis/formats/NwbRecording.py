@@ -31,6 +31,13 @@ import numpy as np
 import pandas as pd
 
 from open_ephys.analysis.recording import Recording
+from open_ephys.analysis.formats.helpers import channel_slice, scale_samples
+from open_ephys.analysis.utils import list_directory
+
+# h5py applies these per chunked dataset: a 32 MiB cache holds several
+# multi-MiB chunks, and a prime slot count keeps hash collisions low
+CHUNK_CACHE_BYTES = 32 * 1024 * 1024
+CHUNK_CACHE_SLOTS = 10007
 
 class NwbRecording(Recording):
     
@@ -41,11 +48,15 @@ class NwbRecording(Recording):
             self.metadata = {}
             self.metadata['name'] = dataset.split('.')[-1]
             self.metadata['stream_name'] = dataset.split('.')[-2]
-            self.metadata['num_channels'] = nwb['acquisition'][dataset]['data'][()].shape[1]
+            self.metadata['num_channels'] = nwb['acquisition'][dataset]['data'].shape[1]
 
             self.timestamps = nwb['acquisition'][dataset]['timestamps'][()]
             self.sample_numbers = nwb['acquisition'][dataset]['sync'][()]
-            self.waveforms = nwb['acquisition'][dataset]['data'][()].astype('float64')
+
+            # HDF5 converts to float64 while reading, so only one buffer is allocated
+            data = nwb['acquisition'][dataset]['data']
+            self.waveforms = np.empty(data.shape, dtype='float64')
+            data.read_direct(self.waveforms)
 
             self.waveforms *= (nwb['acquisition'][dataset]['channel_conversion'][0] * 1e6)
     
@@ -67,15 +78,44 @@ class NwbRecording(Recording):
 
             self.metadata['sample_rate'] = np.around(1 / nwb['acquisition'][dataset]['timestamps'].attrs['interval'], 1)
             self.metadata['num_channels'] = nwb['acquisition'][dataset]['data'].shape[1]
-            self.metadata['bit_volts'] = \
-                    list(nwb['acquisition'][dataset]['channel_conversion'][()] * 1e6)
-
-            self.samples = nwb['acquisition'][dataset]['data'][()]
+            self._bit_volts = nwb['acquisition'][dataset]['channel_conversion'][()] * 1e6
+            self.metadata['bit_volts'] = list(self._bit_volts)
+
+            # samples stay in the file until .samples is accessed;
+            # get_samples only reads the requested block
+            self._filename = nwb.filename
+            self._dataset_name = dataset
+            self._file = nwb
+            self._samples_dataset = nwb['acquisition'][dataset]['data']
+            self._samples = None
             self.sample_numbers = nwb['acquisition'][dataset]['sync'][()]
             self.timestamps = nwb['acquisition'][dataset]['timestamps'][()]
 
             self.global_timestamps = None
+
+        @property
+        def samples(self):
+            if self._samples is None:
+                self._samples = self._dataset()[()]
+            return self._samples
+
+        @samples.setter
+        def samples(self, samples):
+            self._samples = samples
         
+        def _dataset(self):
+            """
+            Returns the samples dataset, reopening the file read-only if the
+            recording has closed it (through close() or garbage collection).
+            """
+
+            if not self._samples_dataset.id.valid:
+                self._file = h5.File(self._filename, 'r',
+                                     rdcc_nbytes=CHUNK_CACHE_BYTES,
+                                     rdcc_nslots=CHUNK_CACHE_SLOTS)
+                self._samples_dataset = self._file['acquisition'][self._dataset_name]['data']
+            return self._samples_dataset
+
         def get_samples(self, start_sample_index, end_sample_index, selected_channels=None):
             """
             Returns samples scaled to microvolts. Converts sample values
@@ -100,72 +140,172 @@ class NwbRecording(Recording):
             if selected_channels is None:
                 selected_channels = np.arange(self.metadata['num_channels'])
 
-            samples = self.samples[start_sample_index:end_sample_index, selected_channels].astype('float64')
+            channels = channel_slice(selected_channels)
 
-            for idx, channel in enumerate(selected_channels):
-                samples[:,idx] = samples[:,idx] * self.metadata['bit_volts'][channel]
+            # slicing past the last channel would silently drop columns;
+            # scale_samples raises IndexError for these selections instead
+            if channels is not None and channels.stop > self.metadata['num_channels']:
+                channels = None
 
-            return samples
+            # samples already in memory are used as they are; otherwise only
+            # the requested block is read from the file
+            if self._samples is not None:
+                source = self._samples
+            else:
+                source = self._dataset()
+
+            # contiguous channels are read from the file as a single hyperslab
+            if channels is not None:
+                samples = source[start_sample_index:end_sample_index, channels]
+                return scale_samples(samples,
+                                     np.arange(samples.shape[1]),
+                                     self._bit_volts[channels])
+
+            return scale_samples(source[start_sample_index:end_sample_index],
+                                 selected_channels,
+                                 self._bit_volts)
             
     def __init__(self, directory, experiment_index=0, recording_index=0):
         
        Recording.__init__(self, directory, experiment_index, recording_index)  
        self._format = 'nwb'
        self.nwb = h5.File(os.path.join(self.directory, 'experiment' + 
-                                 str(self.experiment_index+1) + '.nwb'), 'r')
+                                 str(self.experiment_index+1) + '.nwb'), 'r',
+                          rdcc_nbytes=CHUNK_CACHE_BYTES,
+                          rdcc_nslots=CHUNK_CACHE_SLOTS)
+       self._datasets = None
+
+    @property
+    def datasets(self):
+        if self._datasets is None:
+            self._index_datasets()
+        return self._datasets
+
+    def close(self):
+        """Closes the underlying NWB file"""
+
+        if getattr(self, 'nwb', None) is not None:
+            self.nwb.close()
+            self.nwb = None
     
-    def __delete__(self):
+    def __enter__(self):
 
-        self.nwb.close()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.close()
+
+    def __del__(self):
+
+        self.close()
+       
+    def _index_datasets(self):
+        """
+        Groups the names of the acquisition datasets by type, so the
+        group and its attributes are only scanned once per file.
+        """
+
+        self._datasets = {'ElectricalSeries' : [],
+                          'SpikeEventSeries' : [],
+                          'TTL' : []}
+
+        for dataset, group in self.nwb['acquisition'].items():
+
+            if dataset[-4:] == '.TTL':
+                self._datasets['TTL'].append(dataset)
+            else:
+                neurodata_type = group.attrs.get('neurodata_type')
+
+                if neurodata_type in self._datasets:
+                    self._datasets[neurodata_type].append(dataset)
        
     def load_continuous(self):
-        
-        datasets = list(self.nwb['acquisition'].keys())
 
-        self._continuous = [self.Continuous(self.nwb, dataset) for dataset in datasets
-                            if self.nwb['acquisition'][dataset].attrs['neurodata_type'] == 'ElectricalSeries']
+        self._continuous = [self.Continuous(self.nwb, dataset)
+                            for dataset in self.datasets['ElectricalSeries']]
     
-    def load_spikes(self):
+    def load_stream_metadata(self):
+
+        self._stream_metadata = {}
+
+        # only dataset attributes and shapes are read
+        for dataset in self.datasets['ElectricalSeries']:
+
+            source_node = dataset.split('.')[0]
+            stream_name = dataset.split('.')[1]
+
+            self._stream_metadata[(int(source_node[-3:]), stream_name)] = \
+                {'source_node_name' : source_node[:-4],
+                 'sample_rate' : np.around(1 / self.nwb['acquisition'][dataset]['timestamps'].attrs['interval'], 1),
+                 'num_channels' : self.nwb['acquisition'][dataset]['data'].shape[1]}
         
-        datasets = list(self.nwb['acquisition'].keys())   
+    def load_spikes(self):
 
-        self._spikes = [self.Spikes(self.nwb, dataset) for dataset in datasets
-                         if self.nwb['acquisition'][dataset].attrs['neurodata_type'] == 'SpikeEventSeries']
+        self._spikes = [self.Spikes(self.nwb, dataset)
+                        for dataset in self.datasets['SpikeEventSeries']]
 
     def load_events(self):
          
-        datasets = list(self.nwb['acquisition'].keys())   
+        datasets = self.datasets['TTL']
+
+        total_events = sum(self.nwb['acquisition'][dataset]['data'].shape[0]
+                           for dataset in datasets)
 
-        events = []
-        processor_ids = []
+        channel_states = np.empty(total_events, dtype='int16')
+        sample_numbers = np.empty(total_events, dtype='int64')
+        timestamps = np.empty(total_events, dtype='float64')
+        processor_ids = np.empty(total_events, dtype='int32')
+        stream_indexes = np.empty(total_events, dtype='int16')
+        stream_codes = np.empty(total_events, dtype='int16')
+
+        stream_names = {}
+        stream_ids = {}
+        offset = 0
         
         for dataset in datasets:
+
+            processor_id = int(dataset.split('.')[0].split('-')[-1])
+            stream_name = dataset.split('.')[1]
+
+            stream_id = stream_ids.get(processor_id, -1) + 1
+            stream_ids[processor_id] = stream_id
             
-            if (dataset[-4:] == '.TTL'):
+            ds = self.nwb['acquisition'][dataset]
+            count = ds['data'].shape[0]
 
-                processor_id = int(dataset.split('.')[0].split('-')[-1])
-                stream_name = dataset.split('.')[1]
+            if count == 0:
+                continue
 
-                if processor_id not in processor_ids:
-                    processor_ids.append(processor_id)
-                    stream_id = 0
-                else:
-                    stream_id += 1
-                
-                ds = self.nwb['acquisition'][dataset]
-                channel_states = ds['data'][()]
-                sample_numbers = ds['sync'][()]
-                timestamps = ds['timestamps'][()]
+            block = np.s_[offset:offset + count]
+
+            ds['data'].read_direct(channel_states, dest_sel=block)
+            ds['sync'].read_direct(sample_numbers, dest_sel=block)
+            ds['timestamps'].read_direct(timestamps, dest_sel=block)
+
+            processor_ids[block] = processor_id
+            stream_indexes[block] = stream_id
+            stream_codes[block] = stream_names.setdefault(stream_name, len(stream_names))
+
+            offset += count
                 
-                events.append(pd.DataFrame(
-                    data = {'line' : np.abs(channel_states),
-                            'timestamp' : timestamps,
-                            'sample_number' : sample_numbers,
-                            'processor_id' : [processor_id] * len(channel_states),
-                            'stream_index' : [stream_id] * len(channel_states),
-                            'stream_name' : [stream_name] * len(channel_states),
-                            'state' : (np.sign(channel_states) + 1 / 2).astype('int')}))
-        self._events = pd.concat(events).sort_values(by=['sample_number', 'stream_index'], ignore_index=True)
+        # sort by sample number, then stream index (np.lexsort is stable, like sort_values)
+        order = np.lexsort((stream_indexes, sample_numbers))
+        channel_states = channel_states[order]
+
+        # state is taken before the sign is dropped in place to get the line
+        state = (channel_states > 0).view('int8')
+        line = np.abs(channel_states, out=channel_states)
+
+        self._events = pd.DataFrame(
+            data = {'line' : line,
+                    'timestamp' : timestamps[order],
+                    'sample_number' : sample_numbers[order],
+                    'processor_id' : processor_ids[order],
+                    'stream_index' : stream_indexes[order],
+                    'stream_name' : pd.Categorical.from_codes(stream_codes[order], list(stream_names)),
+                    'state' : state},
+            copy=False)
 
     def load_messages(self):
         pass
@@ -197,13 +337,11 @@ class NwbRecording(Recording):
     ###############################################################
         
     @staticmethod
-    def detect_format(directory):
-        nwb_files = glob.glob(os.path.join(directory, '*.nwb'))
+    def detect_format(directory, entries=None):
+        if entries is None:
+            entries = list_directory(directory)
 
-        if len(nwb_files) > 0:
-            return True
-        else:
-            return False
+        return any(name.endswith('.nwb') for name in entries)
     
     @staticmethod
     def detect_recordings(directory, mmap_timestamps=True):
@@ -218,13 +356,10 @@ class NwbRecording(Recording):
         for experiment_index, file in enumerate(nwb_files):
 
             try:      
-                f = h5.File(file, 'r')
-            except BlockingIOError:
-                print("Error: " + file + "\nis likely still in use. Try closing the GUI and re-loading the session object.")
-            else:
                 recordings.append(NwbRecording(directory,
                                                         experiment_index,
                                                         0))
-                f.close()
+            except BlockingIOError:
+                print("Error: " + file + "\nis likely still in use. Try closing the GUI and re-loading the session object.")
             
         return recordings
\ No newline at end of file
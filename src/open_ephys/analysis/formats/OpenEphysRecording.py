@@ -25,14 +25,33 @@ SOFTWARE.
 
 import glob
 import os
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 
-import xml.etree.ElementTree as XmlElementTree
+try:
+    from lxml import etree as XmlElementTree
+    XML_PARSER_OPTIONS = {'remove_comments' : True, 'remove_pis' : True}
+except ImportError:
+    import xml.etree.ElementTree as XmlElementTree
+    XML_PARSER_OPTIONS = {}
 
-from open_ephys.analysis.formats.helpers import load, load_continuous
+from open_ephys.analysis.formats.helpers import load, load_continuous, load_sample_numbers, \
+    scale_samples, interpolate_timestamps
 
 from open_ephys.analysis.recording import Recording
+from open_ephys.analysis.utils import list_directory
+
+def parse_xml(file_name):
+    """
+    Returns the root element of an XML file, using lxml if it is installed.
+
+    Comments are dropped, so only elements are enumerated as children
+    (matching xml.etree.ElementTree).
+    """
+
+    parser = XmlElementTree.XMLParser(**XML_PARSER_OPTIONS)
+    return XmlElementTree.parse(file_name, parser).getroot()
 
 class OpenEphysRecording(Recording):
 
@@ -47,7 +66,8 @@ class OpenEphysRecording(Recording):
             self.sample_numbers, self.waveforms, header = \
                 load(os.path.join(directory, info['filename']), recording_index)
 
-            self.waveforms = self.waveforms.astype('float64') * info['bit_volts']
+            # cast and scale in a single pass
+            self.waveforms = np.multiply(self.waveforms, info['bit_volts'], dtype='float64')
 
             self.metadata['sample_rate'] = float(header['sampleRate'])
             self.metadata['num_channels'] = int(info['num_channels'])
@@ -58,9 +78,10 @@ class OpenEphysRecording(Recording):
             
             self.name = files[0].strip().split('_')[-2]
             self.files = files
+            self._is_continuous_file = [os.path.splitext(f)[1] == '.continuous' for f in files]
             self.timestamps_file = info['timestamps_file']
             self.recording_index = recording_index
-            self._sample_numbers_internal, _, _, self.valid_records = load(files[0], recording_index)
+            self._sample_numbers_internal, self.valid_records = load_sample_numbers(files[0], recording_index)
             self.global_timestamps = None
 
             self.reload_required = False
@@ -69,22 +90,18 @@ class OpenEphysRecording(Recording):
             self.sample_range = [self.sample_numbers[0], self.sample_numbers[-1]+1]
             self.selected_channels = np.arange(len(files))
 
-            self.metadata = {}
-
-            self.metadata['source_node_id'] = int(info['source_node_id'])
-            self.metadata['source_node_name'] = info['source_node_name']
-
-            self.metadata['stream_name'] = info['stream_name']
-
-            self.metadata['sample_rate'] = info['sample_rate']
-            self.metadata['num_channels'] = len(files)
+            self.metadata = {'source_node_id' : int(info['source_node_id']),
+                             'source_node_name' : info['source_node_name'],
+                             'stream_name' : info['stream_name'],
+                             'sample_rate' : info['sample_rate'],
+                             'num_channels' : len(files),
+                             'channel_names' : info['channel_names'],
+                             'bit_volts' : info['bit_volts']}
+            self._bit_volts = np.asarray(info['bit_volts'], dtype='float64')
 
-            self.metadata['channel_names'] = info['channel_names']
-            self.metadata['bit_volts'] = info['bit_volts']
-
-            self._load_timestamps()
-
-            self.global_timestamps = None
+            # timestamps are only read from disk when they are first needed
+            self._timestamps = None
+            self._record_timestamps = None
 
         @property
         def samples(self):
@@ -93,6 +110,16 @@ class OpenEphysRecording(Recording):
                 self.reload_required = False
             return self._samples
 
+        @property
+        def timestamps(self):
+            if self._timestamps is None:
+                self._timestamps = self._interpolate_timestamps(0, len(self._sample_numbers_internal))
+            return self._timestamps
+
+        @timestamps.setter
+        def timestamps(self, timestamps):
+            self._timestamps = timestamps
+
         def get_samples(self, start_sample_index, end_sample_index, selected_channels=None):
             """
             Returns samples scaled to microvolts. Converts sample values
@@ -120,12 +147,9 @@ class OpenEphysRecording(Recording):
             if selected_channels is None:
                 selected_channels = np.arange(self.selected_channels.size)
 
-            samples = self.samples[start_sample_index:end_sample_index, selected_channels].astype('float64')
-
-            for idx, channel in enumerate(selected_channels):
-                samples[:,idx] = samples[:,idx] * self.metadata['bit_volts'][self.selected_channels[channel]]
-
-            return samples
+            return scale_samples(self.samples[start_sample_index:end_sample_index],
+                                 selected_channels,
+                                 self._bit_volts[self.selected_channels])
 
         def set_start_sample(self, start_sample):
             """
@@ -188,35 +212,44 @@ class OpenEphysRecording(Recording):
             total_samples = self.sample_range[1] - self.sample_range[0]
             total_channels = len(self.selected_channels)
 
-            self._samples = np.zeros((total_samples, total_channels))
+            # raw 16-bit values, stored channel by channel; get_samples scales to microvolts
+            # (a new buffer every time, so arrays already returned by .samples are left untouched)
+            self._samples = np.zeros((total_samples, total_channels), dtype='int16', order='F')
 
-            channel_idx = 0
+            files = [self.files[file_idx] for file_idx in self.selected_channels
+                     if self._is_continuous_file[file_idx]]
 
-            for file_idx in self.selected_channels:
-                 
-                if os.path.splitext(self.files[file_idx])[1] == '.continuous':
-                    sample_numbers, samples, _, _ = load_continuous(self.files[file_idx], self.recording_index, self.sample_range[0], self.sample_range[1])
-                    
+            def load_channel(filename):
+                return load_continuous(filename, self.recording_index, self.sample_range[0], self.sample_range[1])
+
+            # each channel is stored in its own file, so they can be read concurrently
+            with ThreadPoolExecutor(max_workers=max(1, min(16, len(files)))) as executor:
+                for channel_idx, (sample_numbers, samples, _, _) in enumerate(executor.map(load_channel, files)):
                     self._samples[:,channel_idx] = samples
-                    channel_idx += 1
 
             self.sample_numbers = sample_numbers
 
-            start = np.searchsorted(self._sample_numbers_internal, self.sample_range[0])
-            end = np.searchsorted(self._sample_numbers_internal, self.sample_range[1])
-            self.timestamps = self._timestamps_internal[start:end]
+            # sample numbers are consecutive, so their indices can be computed directly
+            first_sample = self._sample_numbers_internal[0]
+            total_samples = len(self._sample_numbers_internal)
+            start = int(np.clip(self.sample_range[0] - first_sample, 0, total_samples))
+            end = int(np.clip(self.sample_range[1] - first_sample, 0, total_samples))
+            self.timestamps = self._interpolate_timestamps(start, end)
 
         def _load_timestamps(self):
 
+            # one timestamp per 1024-sample record; per-sample values are
+            # only interpolated for the range that is requested
             data = np.memmap(self.timestamps_file, dtype='<f8', offset=0, mode='r')[self.valid_records]
-            data = np.append(data, 2 * data[-1] - data[-2])
+            self._record_timestamps = np.append(data, 2 * data[-1] - data[-2])
 
-            self._timestamps_internal = []
+        def _interpolate_timestamps(self, start_index, end_index):
 
-            for i in range(len(data)-1):
-                self._timestamps_internal.extend(np.linspace(data[i], data[i+1], 1024, endpoint=True))
-            
-            self.timestamps = self._timestamps_internal
+            if self._record_timestamps is None:
+                self._load_timestamps()
+
+            # same result as calling np.linspace(data[i], data[i+1], 1024) for each record
+            return interpolate_timestamps(self._record_timestamps, start_index, end_index)
 
    
             
@@ -235,6 +268,20 @@ class OpenEphysRecording(Recording):
             self.experiment_info = os.path.join(directory, 'Continuous_Data' + self.experiment_id + '.openephys')
            
         self._format = 'open-ephys'
+        self._xml_root = None
+
+    @property
+    def xml_root(self):
+        if self._xml_root is None:
+            self._xml_root = parse_xml(self.experiment_info)
+        return self._xml_root
+
+    def _recording_streams(self):
+        """Returns the stream elements for this recording (empty if it is not in the file)"""
+        try:
+            return self.xml_root[self.recording_index]
+        except IndexError:
+            return []
        
     def load_continuous(self):
         
@@ -253,6 +300,14 @@ class OpenEphysRecording(Recording):
                             files_for_stream, 
                             self.recording_index))
         
+    def load_stream_metadata(self):
+
+        self._stream_metadata = {(int(stream.get('source_node_id')), stream.get('name')) :
+                                 {'source_node_name' : stream.get('source_node_name'),
+                                  'sample_rate' : float(stream.get('sample_rate')),
+                                  'num_channels' : len(stream.findall('CHANNEL'))}
+                                 for stream in self._recording_streams()}
+        
     def load_spikes(self):
 
         spike_file_info, _, _ = self.find_spikes_files()
@@ -266,28 +321,36 @@ class OpenEphysRecording(Recording):
     
     def load_events(self):
         
-        tree = XmlElementTree.parse(self.experiment_info)
-        root = tree.getroot()
-
-        events = []
+        # collect each column across streams, then build a single DataFrame
+        columns = {'line' : [], 'sample_number' : [], 'processor_id' : [],
+                   'stream_index' : [], 'stream_name' : [], 'state' : []}
+        stream_names = {}
         
-        for recording_index, child in enumerate(root):
-            if (recording_index == self.recording_index):
-                for stream_index, stream in enumerate(child):
-                    for file_index, file in enumerate(stream):
-                        if file.tag == 'EVENTS':
-                            stream_name = file.get('filename').replace('_','.').split('.')[1]
-                            sample_number, processor_id, state, channel, header = \
-                                load(os.path.join(self.directory, 
-                                      file.get('filename')), self.recording_index)
-                            events.append(pd.DataFrame(data = {'line' : channel + 1,
-                              'sample_number' : sample_number,
-                              'processor_id' : processor_id,
-                              'stream_index' : [stream_index] * len(sample_number),
-                              'stream_name' : [stream_name] * len(sample_number),
-                              'state' : state}))
-
-        self._events = pd.concat(events).sort_values(by=['sample_number', 'stream_index'], ignore_index=True)
+        for stream_index, stream in enumerate(self._recording_streams()):
+            for file_index, file in enumerate(stream):
+                if file.tag == 'EVENTS':
+                    stream_name = file.get('filename').replace('_','.').split('.')[1]
+                    sample_number, processor_id, state, channel, header = \
+                        load(os.path.join(self.directory, 
+                              file.get('filename')), self.recording_index)
+                    columns['line'].append(channel + 1)
+                    columns['sample_number'].append(sample_number)
+                    columns['processor_id'].append(processor_id)
+                    columns['stream_index'].append(np.full(len(sample_number), stream_index, dtype='int16'))
+                    columns['stream_name'].append(np.full(len(sample_number), 
+                                                          stream_names.setdefault(stream_name, len(stream_names)),
+                                                          dtype='int16'))
+                    columns['state'].append(state)
+
+        columns = {name : np.concatenate(values) for name, values in columns.items()}
+
+        # sort by sample number, then stream index (np.lexsort is stable, like sort_values)
+        order = np.lexsort((columns['stream_index'], columns['sample_number']))
+
+        self._events = pd.DataFrame(data = {name : values[order] for name, values in columns.items()})
+
+        # stream names are stored as category codes rather than one string per event
+        self._events['stream_name'] = pd.Categorical.from_codes(self._events['stream_name'], list(stream_names))
 
     def load_messages(self):
         
@@ -296,73 +359,81 @@ class OpenEphysRecording(Recording):
         else:
             messages_file = os.path.join(self.directory, 'messages_' + str(self.experiment_id) + '.events')
 
-        df = pd.read_csv(messages_file, header=None, names=['timestamp', 'message'])
-        splits = np.where(df.message == ' Software Time (milliseconds since midnight Jan 1st 1970 UTC)')[0]
-        splits = np.concatenate((splits, np.array([len(df)])))
+        # find the rows that start each recording without parsing the whole file,
+        # then only parse the rows that belong to this recording
+        with open(messages_file, 'rb') as f:
+            lines = f.read().split(b'\n')
+
+        row_lines = [line_index for line_index, line in enumerate(lines) if line.rstrip(b'\r')]
+
+        splits = [row for row, line_index in enumerate(row_lines)
+                  if lines[line_index].rstrip(b'\r').split(b',', 1)[-1] == 
+                     b' Software Time (milliseconds since midnight Jan 1st 1970 UTC)']
+        splits.append(len(row_lines))
 
-        self._messages = df.iloc[splits[self.recording_index]+1:splits[self.recording_index+1]]
+        start = splits[self.recording_index] + 1
+        end = splits[self.recording_index + 1]
+
+        # the file is already in memory, so split each row on its first comma
+        # instead of running it through the CSV parser
+        rows = [lines[line_index].rstrip(b'\r').decode('utf-8').split(',', 1)
+                for line_index in row_lines[start:end]]
+
+        self._messages = pd.DataFrame(data = {'timestamp' : pd.to_numeric([row[0] for row in rows]),
+                                              'message' : [row[1] if len(row) > 1 else np.nan for row in rows]},
+                                      index = pd.RangeIndex(start, end))
 
     def find_continuous_files(self):
     
-        tree = XmlElementTree.parse(self.experiment_info)
-        root = tree.getroot()
-
         continuous_files = []
         stream_indexes = []
         unique_stream_indexes = []
         stream_info = []
         
-        for recording_index, child in enumerate(root):
-            if (recording_index == self.recording_index):
-                for stream_index, stream in enumerate(child):
-                    unique_stream_indexes.append(stream_index)
-
-                    info = {}
-
-                    info['stream_name'] = stream.get('name')
-                    info['source_node_id'] = stream.get('source_node_id')
-                    info['source_node_name'] = stream.get('source_node_name')
-                    info['sample_rate'] = float(stream.get('sample_rate'))
-                    info['channel_names'] = []
-                    info['bit_volts'] = []
-
-                    for file_index, file in enumerate(stream):
-                        if file.tag == 'CHANNEL':
-                            continuous_files.append(file.get('filename'))
-                            info['channel_names'].append(file.get('name'))
-                            info['bit_volts'].append(float(file.get('bitVolts')))
-                            stream_indexes.append(stream_index)
-                        elif file.tag == 'TIMESTAMPS':
-                            info['timestamps_file'] = os.path.join(self.directory, file.get('filename'))
-
-                    stream_info.append(info)
+        for stream_index, stream in enumerate(self._recording_streams()):
+            unique_stream_indexes.append(stream_index)
+
+            info = {}
+
+            info['stream_name'] = stream.get('name')
+            info['source_node_id'] = stream.get('source_node_id')
+            info['source_node_name'] = stream.get('source_node_name')
+            info['sample_rate'] = float(stream.get('sample_rate'))
+            info['channel_names'] = []
+            info['bit_volts'] = []
+
+            for file_index, file in enumerate(stream):
+                if file.tag == 'CHANNEL':
+                    continuous_files.append(file.get('filename'))
+                    info['channel_names'].append(file.get('name'))
+                    info['bit_volts'].append(float(file.get('bitVolts')))
+                    stream_indexes.append(stream_index)
+                elif file.tag == 'TIMESTAMPS':
+                    info['timestamps_file'] = os.path.join(self.directory, file.get('filename'))
+
+            stream_info.append(info)
         
         return continuous_files, stream_indexes, unique_stream_indexes, stream_info
 
     def find_spikes_files(self):
 
-        tree = XmlElementTree.parse(self.experiment_info)
-        root = tree.getroot()
-
         spike_file_info = []
         stream_indexes = []
         unique_stream_indexes = []
 
-        for recording_index, child in enumerate(root):
-            if (recording_index == self.recording_index):
-                for stream_index, stream in enumerate(child):
-                    unique_stream_indexes.append(stream_index)
-                    for file_index, file in enumerate(stream):
-                        if file.tag == 'SPIKECHANNEL':
-                            info = {'filename' : file.get('filename'),
-                                    'name' : file.get('name'),
-                                    'stream_name' : stream.get('name'),
-                                    'source_node_id' : int(stream.get('source_node_id')),
-                                    'source_node_name' : stream.get('source_node_name'),
-                                    'bit_volts' : float(file.get('bitVolts')),
-                                    'num_channels' : int(file.get('num_channels'))}
-                            spike_file_info.append(info)
-                            stream_indexes.append(stream_index)
+        for stream_index, stream in enumerate(self._recording_streams()):
+            unique_stream_indexes.append(stream_index)
+            for file_index, file in enumerate(stream):
+                if file.tag == 'SPIKECHANNEL':
+                    info = {'filename' : file.get('filename'),
+                            'name' : file.get('name'),
+                            'stream_name' : stream.get('name'),
+                            'source_node_id' : int(stream.get('source_node_id')),
+                            'source_node_name' : stream.get('source_node_name'),
+                            'bit_volts' : float(file.get('bitVolts')),
+                            'num_channels' : int(file.get('num_channels'))}
+                    spike_file_info.append(info)
+                    stream_indexes.append(stream_index)
 
         return spike_file_info, stream_indexes, unique_stream_indexes
         
@@ -390,13 +461,11 @@ class OpenEphysRecording(Recording):
     ###############################################################
     
     @staticmethod
-    def detect_format(directory):
-        open_ephys_files = glob.glob(os.path.join(directory, '*.events'))
+    def detect_format(directory, entries=None):
+        if entries is None:
+            entries = list_directory(directory)
 
-        if len(open_ephys_files) > 0:
-            return True
-        else:
-            return False
+        return any(name.endswith('.events') for name in entries)
     
     @staticmethod
     def detect_recordings(directory, mmap_timestamps=True):
@@ -408,12 +477,17 @@ class OpenEphysRecording(Recording):
 
         for experiment_index, file_name in enumerate(experiment_info):
 
-            tree = XmlElementTree.parse(file_name)
-            root = tree.getroot()
+            root = parse_xml(file_name)
             for recording_index, child in enumerate(root):
-                recordings.append(OpenEphysRecording(directory, 
-                                                    experiment_index,
-                                                    recording_index))
+                recording = OpenEphysRecording(directory, 
+                                               experiment_index,
+                                               recording_index)
+
+                # share the parsed structure file instead of parsing it again
+                if recording.experiment_info == file_name:
+                    recording._xml_root = root
+
+                recordings.append(recording)
                 
         return recordings
 
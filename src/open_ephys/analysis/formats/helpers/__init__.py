@@ -1 +1,2 @@
-from .oe_fast_loader import load, load_continuous, load_events, load_spikes
\ No newline at end of file
+from .oe_fast_loader import load, load_continuous, load_events, load_spikes, load_sample_numbers
+from .kernels import channel_slice, scale_samples, interpolate_timestamps
\ No newline at end of file
@@ -0,0 +1,190 @@
+"""
+MIT License
+
+Copyright (c) 2020 Open Ephys
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+if njit is not None:
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _scale_block(samples, channel_indices, scales, out):
+        for t in prange(out.shape[0]):
+            for i in range(channel_indices.shape[0]):
+                out[t, i] = samples[t, channel_indices[i]] * scales[i]
+
+    @njit(parallel=True, cache=True)
+    def _fill_timestamps(record_timestamps, start_index, samples_per_record, out):
+        last = samples_per_record - 1
+        for i in prange(out.shape[0]):
+            record, offset = divmod(start_index + i, samples_per_record)
+            record_start = record_timestamps[record]
+            record_end = record_timestamps[record + 1]
+            if offset == last:
+                out[i] = record_end
+            else:
+                out[i] = offset * ((record_end - record_start) / last) + record_start
+
+
+def channel_slice(selected_channels):
+
+    """
+    Returns an equivalent slice if the selected channels are a contiguous,
+    increasing range of non-negative indices; otherwise returns None.
+
+    Slicing (rather than fancy indexing) lets h5py read a single hyperslab
+    and lets NumPy return a view instead of a copy.
+
+    Input:
+    =====
+    selected_channels - np.array
+        Indices of the selected channels
+
+    """
+
+    selected_channels = np.asarray(selected_channels)
+
+    if selected_channels.ndim != 1 or selected_channels.size == 0 or selected_channels[0] < 0:
+        return None
+
+    if np.all(np.diff(selected_channels) == 1):
+        return slice(int(selected_channels[0]), int(selected_channels[-1]) + 1)
+
+    return None
+
+
+def scale_samples(samples, selected_channels, bit_volts):
+
+    """
+    Selects a subset of channels from a block of samples and
+    scales them to microvolts, returning 64-bit floats.
+
+    If Numba is installed, the gather, cast, and multiply are
+    fused into a single parallel loop; otherwise NumPy is used.
+
+    Input:
+    =====
+    samples - np.array (N x M)
+        Raw samples for each of M channels
+
+    selected_channels - np.array
+        Indices of the channels (columns) to return
+
+    bit_volts - list or np.array (M)
+        Scaling factor for each channel in samples
+
+    Output:
+    ======
+    samples - np.array (N x len(selected_channels)) (float64)
+        Scaled samples for the selected channels
+
+    """
+
+    selected_channels = np.asarray(selected_channels, dtype='int64')
+
+    # the Numba kernel does not check bounds, so indices are validated here and
+    # negative ones are resolved the way NumPy indexing would resolve them
+    num_channels = samples.shape[1]
+
+    if np.any((selected_channels < -num_channels) | (selected_channels >= num_channels)):
+        raise IndexError('Channel indices must be in the range [%d, %d)' % (-num_channels, num_channels))
+
+    selected_channels = np.where(selected_channels < 0, selected_channels + num_channels, selected_channels)
+
+    scales = np.asarray(bit_volts, dtype='float64')[selected_channels]
+
+    out = np.empty((samples.shape[0], selected_channels.size), dtype='float64')
+
+    if njit is None:
+        # contiguous channels are read through a view rather than gathered into a copy
+        channels = channel_slice(selected_channels)
+        if channels is None:
+            channels = selected_channels
+
+        # cast and scale in a single pass, writing straight into the output
+        np.multiply(samples[:, channels], scales, out=out, dtype='float64')
+    else:
+        _scale_block(np.asarray(samples), selected_channels, scales, out)
+
+    return out
+
+
+def interpolate_timestamps(record_timestamps, start_index, end_index, samples_per_record=1024):
+
+    """
+    Interpolates per-sample timestamps from one timestamp per record,
+    giving the same values as np.linspace(t[i], t[i+1], samples_per_record)
+    for each record i.
+
+    If Numba is installed, the output is filled in a single parallel
+    loop without allocating any per-sample temporaries.
+
+    Input:
+    =====
+    record_timestamps - np.array (R + 1)
+        Timestamp of the first sample of each record, followed by
+        the timestamp at the end of the last record
+
+    start_index - int
+        Index of the first sample to return
+
+    end_index - int
+        Index after the last sample to return
+
+    samples_per_record - int
+        Number of samples in each record
+
+    Output:
+    ======
+    timestamps - np.array (end_index - start_index) (float64)
+        Timestamp of each sample
+
+    """
+
+    # the Numba kernel does not check bounds, so both paths validate the range here
+    if end_index > start_index and \
+       (start_index < 0 or end_index > (len(record_timestamps) - 1) * samples_per_record):
+        raise IndexError('Sample range [%d, %d) is outside the %d samples covered by the record timestamps'
+                         % (start_index, end_index, (len(record_timestamps) - 1) * samples_per_record))
+
+    if njit is not None:
+        out = np.empty(max(end_index - start_index, 0), dtype='float64')
+        _fill_timestamps(np.asarray(record_timestamps, dtype='float64'),
+                         start_index, samples_per_record, out)
+        return out
+
+    record, offset = np.divmod(np.arange(start_index, end_index), samples_per_record)
+
+    record_start = record_timestamps[record]
+    record_end = record_timestamps[record + 1]
+
+    last = samples_per_record - 1
+
+    timestamps = offset * ((record_end - record_start) / last) + record_start
+    timestamps[offset == last] = record_end[offset == last]
+
+    return timestamps
@@ -23,6 +23,8 @@ SOFTWARE.
 """
 
 import os
+import re
+from functools import lru_cache
 import numpy as np
 
 NUM_HEADER_BYTES = 1024
@@ -31,6 +33,14 @@ BYTES_PER_SAMPLE = 2
 RECORD_MARKER = np.array([0, 1, 2, 3, 4, 5, 6, 7, 8, 255])
 RECORD_SIZE = 4 + 8 + SAMPLES_PER_RECORD * BYTES_PER_SAMPLE + len(RECORD_MARKER) # size of each continuous record in bytes
 EVENT_RECORD_SIZE = 32
+HEADER_FIELD = re.compile(rb'header\.(\w+) = ([^;]*);') # e.g. header.sampleRate = 30000;
+
+# layout of each continuous record (samples are big-endian, everything else is little-endian)
+RECORD_DTYPE = np.dtype([('sample_number', '<i8'),
+                         ('num_samples', '<u2'),
+                         ('recording_number', '<u2'),
+                         ('samples', '>i2', (SAMPLES_PER_RECORD,)),
+                         ('marker', '<u1', (len(RECORD_MARKER),))])
 
 
 def readHeader(filename):
@@ -38,6 +48,9 @@ def readHeader(filename):
     """
     Reads in the header of an Open Ephys data file.
     
+    Headers are cached until the file is modified, so repeated
+    loads of the same file only parse its header once.
+    
     Input:
     =====
     filename - string
@@ -45,15 +58,16 @@ def readHeader(filename):
     
     """
     
-    f = open(filename,'rb')
+    return dict(_parseHeader(filename, os.path.getmtime(filename)))
+
+
+@lru_cache(maxsize=512)
+def _parseHeader(filename, mtime):
     
-    header = { }
-    h = f.read(NUM_HEADER_BYTES).decode().replace('\n','').replace('header.','')
-    for i,item in enumerate(h.split(';')):
-        if '=' in item:
-            header[item.split(' = ')[0]] = item.split(' = ')[1]
-            
-    return header
+    with open(filename,'rb') as f:
+        h = f.read(NUM_HEADER_BYTES)
+    
+    return {key.decode() : value.decode() for key, value in HEADER_FIELD.findall(h)}
 
 
 def getNumRecords(filename, record_size):
@@ -73,9 +87,7 @@ def getNumRecords(filename, record_size):
     
     """
     
-    f = open(filename,'rb')
-            
-    numRecords = (os.fstat(f.fileno()).st_size - NUM_HEADER_BYTES) / record_size
+    numRecords = (os.path.getsize(filename) - NUM_HEADER_BYTES) / record_size
     
     assert numRecords % 1 == 0
             
@@ -115,6 +127,46 @@ def load(filename, recording_index):
     else:
         raise Exception("File extension " + extension + " not recognized")
 
+def load_sample_numbers(filename, recording_index):
+    
+    """
+    Loads the sample numbers of a continuous file, reading only the
+    record headers (no samples are copied out of the file)
+    
+    Input:
+    =====
+    filename - string
+        path to the data file (.continuous)
+    
+    recording_index - int
+        index of the recording (0, 1, 2, etc.)
+        
+    Output:
+    ======
+    sample_numbers - np.array (N x 0)
+        Sample numbers for each of N data samples
+    
+    valid_records - np.array (R x 0) (bool)
+        True for each of R records that belongs to this recording
+    
+    """
+    
+    numRecords = getNumRecords(filename, RECORD_SIZE)
+    
+    data = np.memmap(filename, mode='r', dtype=RECORD_DTYPE,
+                 shape = (numRecords,),
+                 offset = NUM_HEADER_BYTES)
+
+    valid_records = data['recording_number'] == recording_index
+
+    first_record = np.min(np.where(valid_records)[0])
+
+    start_sample_number = int(data['sample_number'][first_record])
+
+    sample_numbers = np.arange(start_sample_number, start_sample_number + np.count_nonzero(valid_records) * SAMPLES_PER_RECORD)
+
+    return sample_numbers, valid_records
+
 def load_continuous(filename, recording_index, start_sample=None, end_sample=None):
     
     """
@@ -149,45 +201,35 @@ def load_continuous(filename, recording_index, start_sample=None, end_sample=Non
     
     """
     
-    numRecords = getNumRecords(filename, RECORD_SIZE)
-    
     header = readHeader(filename)
-    
-    data = np.memmap(filename, mode='r', dtype='>i2', 
-                 shape = (numRecords, RECORD_SIZE//2), 
-                 offset = 1024)
 
-    valid_records = data[:,5] == recording_index * 256
-    
-    sample_mask = np.zeros((RECORD_SIZE//2,), dtype='bool')
-    sample_mask[6:-5] = 1
-    sample_mask = np.tile(sample_mask, (data.shape[0],1))
-    
-    record_mask = np.zeros(data.shape, dtype='bool')
-    record_mask[valid_records,:] = 1
-    
-    mask = record_mask * sample_mask
-    
-    first_record = np.min(np.where(valid_records)[0])
-    
-    samples = data.flatten()[mask.flatten()]
-    
-    f = open(filename,'rb')
-    start_sample_number = np.fromfile(f, np.dtype('<i8'), count = 1, offset=1024 + first_record * RECORD_SIZE) # little-
-    
-    sample_numbers = np.arange(start_sample_number, start_sample_number + samples.size)
+    sample_numbers, valid_records = load_sample_numbers(filename, recording_index)
+
+    data = np.memmap(filename, mode='r', dtype=RECORD_DTYPE,
+                 shape = (len(valid_records),),
+                 offset = NUM_HEADER_BYTES)
+
+    record_indexes = np.where(valid_records)[0]
 
+    # sample numbers are consecutive, so their indices can be computed directly
     if start_sample is not None:
-        start = np.searchsorted(sample_numbers, start_sample)
+        start = int(np.clip(start_sample - sample_numbers[0], 0, len(sample_numbers)))
     else:
         start = 0
     
     if end_sample is not None:
-        end = np.searchsorted(sample_numbers, end_sample)
+        end = int(np.clip(end_sample - sample_numbers[0], 0, len(sample_numbers)))
     else:
         end = len(sample_numbers)
 
-    return sample_numbers[start:end], samples[start:end], header, valid_records
+    # only the samples of the records that overlap the requested range are copied out of the file
+    first = start // SAMPLES_PER_RECORD
+    last = -(-end // SAMPLES_PER_RECORD)
+    samples = data['samples'][record_indexes[first:last]].reshape(-1)
+
+    offset = first * SAMPLES_PER_RECORD
+
+    return sample_numbers[start:end], samples[start-offset:end-offset], header, valid_records
 
 
 def load_events(filename, recording_index):
@@ -270,9 +312,9 @@ def load_spikes(filename, recording_number):
     
     header = readHeader(filename)
     
-    f = open(filename, 'rb')
-    numChannels = np.fromfile(f, np.dtype('<u2'), 1, offset=1043)[0] 
-    numSamples = np.fromfile(f, np.dtype('<u2'), 1)[0] # can be 0, ideally 40 (divisible by 8)
+    with open(filename, 'rb') as f:
+        numChannels = np.fromfile(f, np.dtype('<u2'), 1, offset=1043)[0] 
+        numSamples = np.fromfile(f, np.dtype('<u2'), 1)[0] # can be 0, ideally 40 (divisible by 8)
     
     SPIKE_RECORD_SIZE = 42 + \
                         2 * numChannels * numSamples + \
@@ -284,17 +326,17 @@ def load_spikes(filename, recording_number):
 
     NUM_HEADER_BYTES = 1024
     
-    f = open(filename,'rb')
-    numSpikes = (os.fstat(f.fileno()).st_size - NUM_HEADER_BYTES) // SPIKE_RECORD_SIZE
+    numSpikes = (os.path.getsize(filename) - NUM_HEADER_BYTES) // SPIKE_RECORD_SIZE
 
-    sample_numbers = np.zeros((numSpikes,), dtype='<i8')
-    
-    f.seek(NUM_HEADER_BYTES + 1)
-    
-    for i in range(len(sample_numbers)):
-        
-        sample_numbers[i] = np.fromfile(f, np.dtype('<i8'), 1)
-        f.seek(NUM_HEADER_BYTES + 1 + SPIKE_RECORD_SIZE * i)
+    # each record starts with a 1-byte event type followed by the 8-byte sample number
+    records = np.memmap(filename, mode='r',
+                        dtype=np.dtype([('event_type', '<u1'),
+                                        ('sample_number', '<i8'),
+                                        ('rest', 'V%d' % (SPIKE_RECORD_SIZE - 9))]),
+                        shape = (numSpikes,),
+                        offset = NUM_HEADER_BYTES)
+
+    sample_numbers = records['sample_number']
     
 
     data = np.memmap(filename, mode='r', dtype='<u2', 
@@ -305,9 +347,10 @@ def load_spikes(filename, recording_number):
 
     sample_numbers = np.copy(sample_numbers[mask])
  
-    waveforms = np.copy(data[mask, 21:-POST_BYTES//2].reshape((np.sum(mask), numChannels, numSamples))).astype('float32')
+    waveforms = data[mask, 21:-POST_BYTES//2].reshape((np.sum(mask), numChannels, numSamples)).view('<i2')
     
-    waveforms -= 32768
+    # flipping the sign bit subtracts the 32768 offset while converting to signed 16-bit
+    waveforms ^= np.int16(-32768)
     
     return sample_numbers, waveforms, header
 
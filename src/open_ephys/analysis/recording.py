@@ -25,6 +25,8 @@ SOFTWARE.
 
 from abc import ABC, abstractmethod
 import warnings
+
+import numpy as np
     
 class Recording(ABC):
     """ Abstract class representing data from a single Recording
@@ -72,6 +74,12 @@ class Recording(ABC):
         - timestamp
         - sample_number
         - message
+
+    stream_metadata is a dict keyed by (source_node_id, stream_name),
+    which describes each continuous stream without loading it
+        - source_node_name
+        - sample_rate
+        - num_channels
     
     """
     
@@ -99,6 +107,12 @@ class Recording(ABC):
             self.load_messages()
         return self._messages
     
+    @property
+    def stream_metadata(self):
+        if self._stream_metadata is None:
+            self.load_stream_metadata()
+        return self._stream_metadata
+    
     @property
     def format(self):
         return self._format
@@ -132,6 +146,9 @@ class Recording(ABC):
         self._events = None
         self._spikes = None
         self._messages = None
+        self._stream_metadata = None
+        self._event_groups = None
+        self._sync_key = None
         
         self.sync_lines = []
         
@@ -151,9 +168,20 @@ class Recording(ABC):
     def load_messages(self):
         pass
     
+    def load_stream_metadata(self):
+        """Collects the metadata of each continuous stream
+        (formats that can read it without loading the streams override this)"""
+        
+        self._stream_metadata = {(continuous.metadata['source_node_id'], continuous.metadata['stream_name']) :
+                                 {'source_node_name' : continuous.metadata['source_node_name'],
+                                  'sample_rate' : continuous.metadata['sample_rate'],
+                                  'num_channels' : continuous.metadata['num_channels']}
+                                 for continuous in self.continuous}
+    
     @abstractmethod
-    def detect_format(directory):
-        """Return True if the format matches the Record Node directory contents"""
+    def detect_format(directory, entries=None):
+        """Return True if the format matches the Record Node directory contents
+        (entries optionally lists the directory's contents, to avoid listing it again)"""
         pass
     
     @abstractmethod
@@ -166,6 +194,42 @@ class Recording(ABC):
         """Returns a string with information about the Recording"""
         pass
     
+    def _find_events(self, processor_id, stream_name, line=None, state=None):
+        """Returns the positions (in file order) of the events from one stream,
+        optionally restricted to one line and/or state"""
+
+        # group row positions by source once, so each lookup only scans the group keys
+        # (regrouped whenever the events DataFrame is replaced)
+        if self._event_groups is None or self._event_groups[0] is not self.events:
+            groups = self.events.groupby(['processor_id', 'stream_name', 'line', 'state'],
+                                         observed=True, sort=False).indices
+            self._event_groups = (self.events, groups)
+
+        rows = [indices for (group_processor_id, group_stream_name, group_line, group_state), indices 
+                in self._event_groups[1].items()
+                if group_processor_id == processor_id and group_stream_name == stream_name and
+                   (line is None or group_line == line) and
+                   (state is None or group_state == state)]
+
+        if len(rows) == 0:
+            return np.array([], dtype='int64')
+
+        return np.sort(np.concatenate(rows))
+
+    def _sync_sample_numbers(self, sync_line):
+        """Returns the sample numbers of the rising edges on a sync line,
+        excluding any that fall within its ignore intervals"""
+
+        sample_numbers = self.events.sample_number.to_numpy()[
+            self._find_events(sync_line['processor_id'], sync_line['stream_name'], sync_line['line'], state=1)]
+
+        # build one mask for all ignore intervals, then filter once
+        keep = np.ones(sample_numbers.shape, dtype=bool)
+        for ignore_interval in sync_line['ignore_intervals']:
+            keep &= (sample_numbers < ignore_interval[0]) | (sample_numbers > ignore_interval[1])
+
+        return sample_numbers[keep]
+
     def add_sync_line(self, line, processor_id, stream_name=None, main=False, ignore_intervals=[]):
         """Specifies an event channel to use for timestamp synchronization. Each 
         sync line in a recording should receive its input from the same 
@@ -192,10 +256,7 @@ class Recording(ABC):
         
         """
 
-        events_on_line = self.events[(self.events.line == line) &
-                                     (self.events.processor_id == processor_id) &
-                                     (self.events.stream_name == stream_name)]
-        
+        events_on_line = self._find_events(processor_id, stream_name, line)
 
         if len(events_on_line) == 0:
             raise Exception('No events found on this line. ' + 
@@ -222,8 +283,10 @@ class Recording(ABC):
                                 'stream_name' : stream_name,
                                 'main' : main,
                                 'ignore_intervals' : ignore_intervals})
+
+        self._sync_key = None
         
-    def compute_global_timestamps(self, overwrite=False):
+    def compute_global_timestamps(self, overwrite=False, verbose=True):
         """After sync channels have been added, this function computes the
         global timestamps for all processors with a shared sync line.
 
@@ -233,8 +296,29 @@ class Recording(ABC):
             if True, overwrite existing timestamps
             if False, add an extra "global_timestamp" column
             default = False
+        verbose : bool
+            if True, print a summary of each sync line
+            default = True
+
+        Repeated calls with the same sync lines and data do not recompute
+        anything; with verbose, a one-line note replaces the summary.
         
         """
+
+        # repeated calls with the same sync lines and data are no-ops;
+        # reloading a stream (e.g. after set_sample_range) replaces its
+        # sample_numbers array, so those are compared by identity as well
+        sync_key = (tuple((sync['line'], sync['processor_id'], sync['stream_name'], sync['main'],
+                           tuple(map(tuple, sync['ignore_intervals'])))
+                          for sync in self.sync_lines), overwrite)
+
+        if self._sync_key is not None and self._sync_key[0] == sync_key and \
+           self._sync_key[1] is self._events and self._sync_key[2] is self._continuous and \
+           all(a is b for a, b in zip(self._sync_key[3],
+                                      [c.sample_numbers for c in self._continuous])):
+            if verbose:
+                print('Global timestamps are already up to date for these sync lines.')
+            return
         
         if len(self.sync_lines) == 0:
             raise Exception('At least two sync lines must be specified ' + 
@@ -253,99 +337,89 @@ class Recording(ABC):
             
         main_line = main_line[0]
 
-        main_events = self.events[(self.events.line == main_line['line']) & 
-                   (self.events.processor_id == main_line['processor_id']) & 
-                   (self.events.stream_name == main_line['stream_name']) &
-                   (self.events.state == 1)]
-        
-        # sort by sample number, in case the original timestamps were incorrect
-        main_events = main_events.sort_values(by='sample_number')
-
-        # remove any events that fall within the ignore intervals
-        for ignore_interval in main_line['ignore_intervals']:
-            main_events = main_events[(main_events.sample_number < ignore_interval[0]) |
-                                      (main_events.sample_number > ignore_interval[1])]
+        main_sample_numbers = self._sync_sample_numbers(main_line)
         
-        main_start_sample = main_events.iloc[0].sample_number
-        main_total_samples = main_events.iloc[-1].sample_number - main_start_sample
+        # only the first and last sync events are needed, so no sort is required
+        main_start_sample = main_sample_numbers.min()
+        main_end_sample = main_sample_numbers.max()
+        main_total_samples = main_end_sample - main_start_sample
         main_line['start'] = main_start_sample
         main_line['scaling'] = 1
         main_line['offset'] = main_start_sample
 
+        # continuous streams for each (source node, stream name), looked up once per sync line
+        streams = {}
         for continuous in self.continuous:
+            streams.setdefault((continuous.metadata['source_node_id'], 
+                                continuous.metadata['stream_name']), []).append(continuous)
 
-            if (continuous.metadata['source_node_id'] == main_line['processor_id']) and \
-               (continuous.metadata['stream_name'] == main_line['stream_name']):
-               main_line['sample_rate'] = continuous.metadata['sample_rate']
+        main_line['sample_rate'] = self.stream_metadata[(main_line['processor_id'], 
+                                                         main_line['stream_name'])]['sample_rate']
         
-        print(f'Processor ID: {main_line["processor_id"]}, Stream Name: {main_line["stream_name"]}, Line: {main_line["line"]} (main sync line))')
-        print(f'  First event sample number: {main_line["start"]}')
-        print(f'  Last event sample number: {main_events.iloc[-1].sample_number}')
-        print(f'  Total sync events: {len(main_events)}')
-        print(f'  Sample rate: {main_line["sample_rate"]}')
+        if verbose:
+            print(f'Processor ID: {main_line["processor_id"]}, Stream Name: {main_line["stream_name"]}, Line: {main_line["line"]} (main sync line))')
+            print(f'  First event sample number: {main_line["start"]}')
+            print(f'  Last event sample number: {main_end_sample}')
+            print(f'  Total sync events: {len(main_sample_numbers)}')
+            print(f'  Sample rate: {main_line["sample_rate"]}')
 
         for aux in aux_lines:
             
-            aux_events = self.events[(self.events.line == aux['line']) &
-                   (self.events.processor_id == aux['processor_id']) &
-                   (self.events.stream_name == aux['stream_name']) &
-                   (self.events.state == 1)]
+            aux_sample_numbers = self._sync_sample_numbers(aux)
             
-            # sort by sample number, in case the original timestamps were incorrect
-            aux_events = aux_events.sort_values(by='sample_number')
-
-            # remove any events that fall within the ignore intervals
-            for ignore_interval in aux['ignore_intervals']:
-                aux_events = aux_events[(aux_events.sample_number < ignore_interval[0]) |
-                                      (aux_events.sample_number > ignore_interval[1])]
-            
-            aux_start_sample = aux_events.iloc[0].sample_number
-            aux_total_samples = aux_events.iloc[-1].sample_number - aux_start_sample
+            # only the first and last sync events are needed, so no sort is required
+            aux_start_sample = aux_sample_numbers.min()
+            aux_end_sample = aux_sample_numbers.max()
+            aux_total_samples = aux_end_sample - aux_start_sample
             
             aux['start'] = aux_start_sample
             aux['scaling'] = main_total_samples / aux_total_samples
             aux['offset'] = main_start_sample
             aux['sample_rate'] = main_line['sample_rate']
 
-            print(f'Processor ID: {aux["processor_id"]}, Stream Name: {aux["stream_name"]}, Line: {main_line["line"]} (aux sync line))')
-            print(f'  First event sample number: {aux["start"]}')
-            print(f'  Last event sample number: {aux_events.iloc[-1].sample_number}')
-            print(f'  Total sync events: {len(aux_events)}')
-            print(f'  Scale factor: {aux["scaling"]}')
-            print(f'  Actual sample rate: {aux["sample_rate"] / aux["scaling"]}')
+            if verbose:
+                print(f'Processor ID: {aux["processor_id"]}, Stream Name: {aux["stream_name"]}, Line: {main_line["line"]} (aux sync line))')
+                print(f'  First event sample number: {aux["start"]}')
+                print(f'  Last event sample number: {aux_end_sample}')
+                print(f'  Total sync events: {len(aux_sample_numbers)}')
+                print(f'  Scale factor: {aux["scaling"]}')
+                print(f'  Actual sample rate: {aux["sample_rate"] / aux["scaling"]}')
+
+        timestamp_column = 'timestamp' if overwrite else 'global_timestamp'
+
+        if timestamp_column not in self.events.columns:
+            # events that are not on a synchronized stream keep NaN
+            self.events[timestamp_column] = np.nan
 
         for sync_line in self.sync_lines: # loop through all sync lines
             
-            for continuous in self.continuous:
-
-                if (continuous.metadata['source_node_id'] == sync_line['processor_id']) and \
-                   (continuous.metadata['stream_name'] == sync_line['stream_name']):
+            for continuous in streams.get((sync_line['processor_id'], sync_line['stream_name']), []):
                        
-                    continuous.global_timestamps = \
-                        ((continuous.sample_numbers - sync_line['start']) * sync_line['scaling'] \
-                            + sync_line['offset']) 
-                    
-                    global_timestamps = continuous.global_timestamps / sync_line['sample_rate']
-                            
-                    if overwrite:
-                        continuous.timestamps = global_timestamps
-                    else:
-                        continuous.global_timestamps = global_timestamps
+                # (sample_number - start) * scaling + offset, computed in a single buffer
+                global_samples = np.subtract(continuous.sample_numbers, sync_line['start'], dtype='float64')
+                np.multiply(global_samples, sync_line['scaling'], out=global_samples)
+                np.add(global_samples, sync_line['offset'], out=global_samples)
+                        
+                if overwrite:
+                    continuous.global_timestamps = global_samples
+                    continuous.timestamps = global_samples / sync_line['sample_rate']
+                else:
+                    continuous.global_timestamps = np.divide(global_samples, sync_line['sample_rate'], 
+                                                             out=global_samples)
                             
-            event_inds = self.events[(self.events.processor_id == sync_line['processor_id']) & 
-                   (self.events.stream_name == sync_line['stream_name'])].index.values
+            event_rows = self._find_events(sync_line['processor_id'], sync_line['stream_name'])
 
-            global_timestamps = (self.events.loc[event_inds].sample_number - sync_line['start']) \
+            global_timestamps = (self.events.sample_number.to_numpy().take(event_rows) - sync_line['start']) \
                                   * sync_line['scaling'] \
                                    + sync_line['offset']
                                    
             global_timestamps = global_timestamps / sync_line['sample_rate']
             
-            if overwrite:
-                self.events.loc[event_inds, 'timestamp'] = global_timestamps
-            else:
-                for ind, ts in zip(event_inds, global_timestamps):
-                    self.events.at[ind, 'global_timestamp'] = ts
+            # positional write, so no index labels need to be looked up
+            self.events.iloc[event_rows, self.events.columns.get_loc(timestamp_column)] = global_timestamps
+
+        self._sync_key = (sync_key, self._events, self._continuous,
+                          [c.sample_numbers for c in self._continuous])
     
                                               
         
@@ -26,6 +26,7 @@ import os
 import glob
 
 from open_ephys.analysis.formats import OpenEphysRecording, BinaryRecording, NwbRecording
+from open_ephys.analysis.utils import list_directory
 
 class RecordNode:
     
@@ -43,6 +44,11 @@ class RecordNode:
     
     """
     
+    # formats are checked in this order; the first match wins
+    formats = {'nwb': NwbRecording,
+               'binary': BinaryRecording,
+               'open-ephys': OpenEphysRecording}
+    
     def __init__(self, directory, mmap_timestamps=True):
         """ Construct a RecordNode object, which provides access to
         data from one Open Ephys Record Node
@@ -69,12 +75,11 @@ class RecordNode:
         Internal method used to detect a Record Node's data format upon initialization.
         """
         
-        self.formats = {'nwb': NwbRecording,
-                        'binary': BinaryRecording,
-                        'open-ephys': OpenEphysRecording}
+        # the directory is listed once and shared by every format check
+        entries = list_directory(self.directory)
         
-        for format_key in self.formats.keys():
-            if self.formats[format_key].detect_format(self.directory):
+        for format_key, format_class in self.formats.items():
+            if format_class.detect_format(self.directory, entries):
                 self.format = format_key
                 return
         
@@ -24,6 +24,7 @@ SOFTWARE.
 
 import glob
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import warnings
 
@@ -46,7 +47,7 @@ class Session:
     
     """
     
-    def __init__(self, directory, mmap_timestamps=True):
+    def __init__(self, directory, mmap_timestamps=True, max_workers=None):
         """ Construct a session object, which provides access to
         data from multiple Open Ephys Record Nodes
 
@@ -57,10 +58,15 @@ class Session:
             If True, timestamps will be memory-mapped for faster access
             (default is True). Set to False if you plan to overwrite the
             timestamps files in the session directory.
+        max_workers: int, optional
+            Number of Record Node directories to scan concurrently
+            (default is up to 8). Set to 1 to scan them one at a time,
+            e.g. on spinning disks.
         """
         
         self.directory = directory;
         self.mmap_timestamps = mmap_timestamps;
+        self.max_workers = max_workers;
         
         self._detect_record_nodes()
         
@@ -80,7 +86,12 @@ class Session:
 
         else:
 
-            self.recordnodes = [RecordNode(path, self.mmap_timestamps) for path in recordnodepaths]
+            max_workers = self.max_workers or min(8, len(recordnodepaths))
+
+            # detection is dominated by file system calls, so Record Nodes are scanned concurrently
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                self.recordnodes = list(executor.map(lambda path: RecordNode(path, self.mmap_timestamps),
+                                                     recordnodepaths))
 
     def __str__(self):
         """Returns a string with information about the Session"""
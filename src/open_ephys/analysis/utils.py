@@ -1,11 +1,45 @@
+import os
 import re
+from functools import lru_cache
 
+NUMBER_CHUNKS = re.compile('([0-9]+)')
+
+@lru_cache(maxsize=4096)
 def alphanum_key(s):
     """
-    Turn a string into a list of string and number chunks.
+    Turn a string into a tuple of string and number chunks.
 
     >>> alphanum_key("z23a")
-    ["z", 23, "a"]
+    ("z", 23, "a")
+
+    """
+    return tuple(int(c) if c.isdigit() else c for c in NUMBER_CHUNKS.split(s))
 
+def find_subdirectories(directory, prefix=''):
     """
-    return [int(c) if c.isdigit() else c for c in re.split('([0-9]+)', s) ]
\ No newline at end of file
+    Return the paths of all subdirectories whose names start with prefix,
+    using a single os.scandir pass (hidden directories are skipped).
+
+    Returns an empty list if the directory does not exist.
+
+    """
+    if not os.path.isdir(directory):
+        return []
+
+    with os.scandir(directory) as entries:
+        return [entry.path for entry in entries
+                if entry.name.startswith(prefix) and not entry.name.startswith('.')
+                and entry.is_dir()]
+
+def list_directory(directory):
+    """
+    Return the names of all entries in a directory, skipping hidden
+    entries (the same names that glob's '*' would match).
+
+    Returns an empty list if the directory does not exist.
+
+    """
+    if not os.path.isdir(directory):
+        return []
+
+    return [name for name in os.listdir(directory) if not name.startswith('.')]
@@ -1,2 +1,2 @@
 from .network_control import NetworkControl
-from .http_server import OpenEphysHTTPServer
\ No newline at end of file
+from .http_server import OpenEphysHTTPServer, OpenEphysHTTPError
\ No newline at end of file
@@ -25,12 +25,27 @@ SOFTWARE.
 import os
 import platform
 import subprocess
+import heapq
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
-import json
 import time 
 
-import glob
+try:
+    import orjson as json # faster, and works on bytes directly
+except ImportError:
+    try:
+        import ujson as json
+    except ImportError:
+        import json
+
+STATUS_CACHE_SECONDS = 0.02 # how long `status` reuses its last response
+RETRY_DELAYS = (0.01, 0.05) # seconds to wait before each retry of a failed GET request
+GET_TIMEOUT = (3.05, 10) # (connect, read) seconds before a GET request is treated as failed
+
+
+class OpenEphysHTTPError(Exception):
+    """Raised when a request to the Open Ephys HTTP Server fails"""
 
 class OpenEphysHTTPServer:
     
@@ -79,6 +94,27 @@ class OpenEphysHTTPServer:
         
         self.address = 'http://' + address + ':37497'
 
+        # reuses one connection (HTTP keep-alive) across requests
+        self.session = requests.Session()
+
+        # a single host, with enough connections for `send_many`
+        self.session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=8))
+
+        if address in ('127.0.0.1', 'localhost'):
+            # proxy settings never apply to the local GUI, so don't read them on every request
+            self.session.trust_env = False
+
+        self._status = None
+        self._status_time = 0.0
+
+    def close(self):
+
+        """
+        Close the connection to the server.
+        """
+
+        self.session.close()
+
     def send(self, endpoint, payload=None):
 
         """
@@ -94,27 +130,81 @@ class OpenEphysHTTPServer:
             
             If a payload is specified, a PUT request
             will be used; otherwise it will be a GET request.
+
+        Returns
+        -------
+        The decoded JSON response
+
+        Raises
+        ------
+        OpenEphysHTTPError
+            If the request fails. GET requests that time out (see
+            GET_TIMEOUT) or lose their connection are retried first;
+            commands (PUT requests) are not, since they may already have
+            been carried out, and have no timeout, since some (e.g. load)
+            can legitimately take a long time.
+        """
+
+        if payload is not None:
+            # any command may change the GUI's state
+            self._status = None
+
+        for attempt in range(len(RETRY_DELAYS) + 1):
+
+            try: 
+
+                if payload is None:
+                    resp = self.session.get(self.address + endpoint, timeout=GET_TIMEOUT)
+                else:
+                    resp = self.session.put(self.address + endpoint, 
+                                        data = json.dumps(payload))
+
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if payload is not None or attempt == len(RETRY_DELAYS):
+                    # Open Ephys server needs to be enabled
+                    raise OpenEphysHTTPError("Open Ephys HTTP Server likely not enabled") from e
+                time.sleep(RETRY_DELAYS[attempt])
+            except requests.exceptions.TooManyRedirects as e:
+                raise OpenEphysHTTPError("Bad URL: " + self.address + endpoint) from e
+            except requests.exceptions.RequestException as e:
+                raise OpenEphysHTTPError("Request to " + self.address + endpoint + " failed") from e
+            else:
+                # parsed from the raw bytes, skipping the response's text decoding
+                return json.loads(resp.content)
+
+    def send_many(self, batch, max_workers=None):
+
         """
+        Send several requests to the server concurrently, so that
+        their network round trips overlap instead of adding up.
 
-        try: 
+        Use this for independent requests only (e.g. setting the same
+        parameter on many streams); their order of arrival is not guaranteed.
 
-            if payload is None:
-                resp = requests.get(self.address + endpoint)
-            else:
-                resp = requests.put(self.address + endpoint, 
-                                    data = json.dumps(payload))
+            >> gui.send_many([('/api/processors/101/streams/0/parameters/low_cut', {'value' : 300.0}),
+                              ('/api/processors/101/streams/1/parameters/low_cut', {'value' : 300.0})])
+
+        Parameters
+        ----------
+        batch : List
+            (endpoint, payload) tuples, with the same meaning
+            as the arguments of `send` (payload may be None)
+        max_workers : Integer
+            The maximum number of requests in flight.
+            Defaults to the number of requests (up to 8).
 
-        except requests.exceptions.Timeout:
-            # Maybe set up for a retry, or continue in a retry loop
-            print("Timeout")
-        except requests.exceptions.TooManyRedirects:
-            # Tell the user their URL was bad and try a different one
-            print("Bad URL")
-        except requests.exceptions.RequestException as e:
-            # Open Ephys server needs to be enabled
-            print("Open Ephys HTTP Server likely not enabled")
+        Returns
+        -------
+        A list of responses, in the same order as the requests
+        """
+
+        batch = list(batch)
 
-        return resp.json()
+        if len(batch) == 0:
+            return []
+
+        with ThreadPoolExecutor(max_workers=max_workers or min(8, len(batch))) as executor:
+            return list(executor.map(lambda request: self.send(*request), batch))
 
     def load(self, config_path):
 
@@ -191,8 +281,9 @@ class OpenEphysHTTPServer:
 
         # If only processor name is specified, set source to most recently added processor
         if source is None and dest is None:
-            if len(self.get_processors()) > 0:
-                payload['source_id'] = max(self.get_processors(), key=lambda processor: processor['id'])['id']
+            processors = self.get_processors()
+            if len(processors) > 0:
+                payload['source_id'] = max(processors, key=lambda processor: processor['id'])['id']
         if source is not None:
             payload['source_id'] = source
         if dest is not None:
@@ -235,11 +326,30 @@ class OpenEphysHTTPServer:
             The index of the stream (e.g. 0).
         """
 
-        endpoint = '/api/processors/' + str(processor_id) + '/streams/' + str(stream_index) + '/parameters'
+        endpoint = f'/api/processors/{processor_id}/streams/{stream_index}/parameters'
         data = self.send(endpoint)
 
         return data
 
+    def get_all_parameters(self):
+
+        """
+        Get parameters for every stream of every processor,
+        using a single request (rather than one `get_parameters`
+        call per stream).
+
+        Returns
+        -------
+        A dictionary mapping each processor ID to a dictionary
+        of stream index -> parameters for that stream
+        """
+
+        data = self.send('/api/processors')
+
+        return {processor['id'] : {stream_index : stream.get('parameters', [])
+                                   for stream_index, stream in enumerate(processor.get('streams', []))}
+                for processor in data['processors']}
+
     def set_parameter(self, processor_id, stream_index, param_name, value):
 
         """
@@ -263,13 +373,38 @@ class OpenEphysHTTPServer:
 
         """
 
-        endpoint = '/api/processors/' + str(processor_id) + '/streams/' + str(stream_index) + '/parameters/' + param_name
+        endpoint = f'/api/processors/{processor_id}/streams/{stream_index}/parameters/{param_name}'
         payload = {
             'value' : value
         }
         data = self.send(endpoint, payload)
         return data
 
+    def set_parameters(self, processor_id, stream_index, parameters):
+
+        """
+        Update several parameter values for one stream
+
+        Parameters
+        ----------
+        processor_id : Integer
+            The 3-digit processor ID (e.g. 101)
+        stream_index : Integer
+            The index of the stream (e.g. 0)
+        parameters : Dictionary
+            The new value for each parameter name (e.g. {'low_cut' : 300.0}),
+            set in the order given
+
+        Returns
+        -------
+        A list of responses, one per parameter
+        """
+
+        endpoint = f'/api/processors/{processor_id}/streams/{stream_index}/parameters/'
+
+        return [self.send(endpoint + param_name, {'value' : value})
+                for param_name, value in parameters.items()]
+
     def get_recording_info(self, key=""):
 
         """
@@ -431,7 +566,7 @@ class OpenEphysHTTPServer:
             Response message
         """
 
-        endpoint = '/api/processors/' + str(node_id) + '/config'
+        endpoint = f'/api/processors/{node_id}/config'
         payload ={ 
             'text' : file_path
         }
@@ -456,7 +591,7 @@ class OpenEphysHTTPServer:
             Response message
         """
 
-        endpoint = '/api/processors/' + str(node_id) + '/config'
+        endpoint = f'/api/processors/{node_id}/config'
         payload ={ 
             'text' : file_index
         }
@@ -476,7 +611,7 @@ class OpenEphysHTTPServer:
                 The record engine index.
         """
 
-        endpoint = '/api/processors/' + str(node_id) + '/config'
+        endpoint = f'/api/processors/{node_id}/config'
         payload = { 
             'text' : engine
         }
@@ -499,7 +634,7 @@ class OpenEphysHTTPServer:
         payload ={ 
             'parent_directory' : directory
         }
-        data = self.send('/api/recording/' + str(node_id), payload)
+        data = self.send(f'/api/recording/{node_id}', payload)
         return data
 
     def status(self):
@@ -507,8 +642,19 @@ class OpenEphysHTTPServer:
         """
         Returns the current status of the GUI (IDLE, ACQUIRE, or RECORD)
 
+        Calls made in quick succession (e.g. in a polling loop) reuse
+        the previous response for up to 20 ms, unless another command
+        has been sent in the meantime.
+
         """
-        return self.send('/api/status')['mode']
+
+        now = time.monotonic()
+
+        if self._status is None or now - self._status_time > STATUS_CACHE_SECONDS:
+            self._status = self.send('/api/status')['mode']
+            self._status_time = now
+
+        return self._status
 
     def acquire(self, duration=0):
 
@@ -683,12 +829,11 @@ class OpenEphysHTTPServer:
         count : Integer
             The number of recordings to return.
         """
-        latest_recordings = []
-        list_of_files = glob.glob(os.path.join(directory, '**'))
 
-        while count > 0 and len(list_of_files) > 0:
-            latest_file = max(list_of_files, key=os.path.getctime)
-            latest_recordings.append(os.path.join(directory, latest_file))
-            list_of_files.remove(latest_file)
-            count -= 1
-        return latest_recordings
\ No newline at end of file
+        # each entry is stat'ed once as the directory is read,
+        # and only the newest `count` are ever held in memory
+        with os.scandir(directory) as entries:
+            latest = heapq.nlargest(count, ((entry.stat().st_ctime, entry.path) for entry in entries
+                                            if not entry.name.startswith('.')))
+
+        return [path for ctime, path in latest]
\ No newline at end of file
@@ -25,6 +25,23 @@ SOFTWARE.
 import zmq
 import time
 
+TTL_MESSAGE = b'TTL Line=%d State=%d' # formatted straight to bytes, with no string building or encoding
+
+def ttl_message(line, state):
+    """Returns the Network Events message for one TTL event,
+    raising ValueError if the line is not a whole number"""
+
+    try:
+        line_number = int(line)
+        is_whole_number = line_number == float(line)
+    except (TypeError, ValueError):
+        is_whole_number = False
+
+    if not is_whole_number:
+        raise ValueError('TTL line must be a whole number, got ' + repr(line))
+
+    return TTL_MESSAGE % (line_number, 1 if state else 0)
+
 class NetworkControl:
     
     """
@@ -85,6 +102,8 @@ class NetworkControl:
         self.socket = self.context.socket(zmq.REQ)
         self.socket.RCVTIMEO = int(1000);
         self.socket.connect(self.url)
+
+        self._pipeline_socket = None
         
     @property
     def start(self):
@@ -138,11 +157,56 @@ class NetworkControl:
             Event state (on = 1/True, off = 0/False)
         
         """
-        if state:
-            self.socket.send_string('TTL Line=' + str(line) + " State=1")
-        else:
-            self.socket.send_string('TTL Line=' + str(line) + " State=0")
+        self.socket.send(ttl_message(line, state))
         self._get_response()
+
+    def send_ttls(self, events):
+        """Trigger several TTL events, sending them all before
+        waiting for the responses (rather than one round trip per event)
+        
+         Parameters
+        ----------
+        events : list of (line, state) tuples
+            TTL line number (1-256) and event state (on = 1/True, off = 0/False),
+            in the order the events should be triggered
+
+        Raises TimeoutError if a response takes longer than 1 s
+        
+        """
+        if self._pipeline_socket is None:
+            # unlike REQ, a DEALER socket can have many requests in flight;
+            # the empty first frame stands in for the REQ envelope
+            self._pipeline_socket = self.context.socket(zmq.DEALER)
+            self._pipeline_socket.RCVTIMEO = int(1000);
+            self._pipeline_socket.connect(self.url)
+
+        # every message is checked before any is sent, so a bad line does not leave replies unread
+        messages = [ttl_message(line, state) for line, state in events]
+
+        for message in messages:
+            self._pipeline_socket.send_multipart([b'', message])
+
+        poller = zmq.Poller()
+        poller.register(self._pipeline_socket, zmq.POLLIN)
+
+        # each reply gets the same 1 s the REQ socket allows
+        for received in range(len(messages)):
+            deadline = time.monotonic() + 1.0
+            while not poller.poll(max(0, int((deadline - time.monotonic()) * 1000))):
+                if time.monotonic() >= deadline:
+                    # replies still in flight would be read by the next call,
+                    # so the socket is dropped and a fresh one is made then
+                    self._close_pipeline_socket()
+                    raise TimeoutError('Timed out after %d of %d TTL responses'
+                                       % (received, len(messages)))
+            print('Response: ' + self._pipeline_socket.recv_multipart()[-1].decode('utf-8'))
+
+    def close(self):
+        """Closes the sockets and the ZeroMQ context"""
+
+        self._close_pipeline_socket()
+        self.socket.close(linger=0)
+        self.context.term()
         
     def wait(self, time_in_seconds):
         """
@@ -157,6 +221,11 @@ class NetworkControl:
         
         time.sleep(time_in_seconds)
         
+    def _close_pipeline_socket(self):
+        if self._pipeline_socket is not None:
+            self._pipeline_socket.close(linger=0)
+            self._pipeline_socket = None
+
     def _get_response(self):
         print('Response: ' + self.socket.recv().decode('utf-8'))
 
@@ -23,7 +23,14 @@ SOFTWARE.
 """
 
 import zmq
-import json
+
+try:
+    import orjson as json # faster, and works on bytes directly
+except ImportError:
+    try:
+        import ujson as json
+    except ImportError:
+        import json
 
 def default_spike_callback(info):
     """
@@ -99,6 +106,9 @@ class EventListener:
 
         self.context = zmq.Context()
         self.socket = self.context.socket(zmq.SUB)
+        # events are already received on ZeroMQ's I/O thread; a deeper queue
+        # (default 1000) lets it keep receiving while a slow callback runs
+        self.socket.setsockopt(zmq.RCVHWM, 100000)
         self.socket.connect(self.url)
         self.socket.setsockopt(zmq.SUBSCRIBE, b'')
 
@@ -131,7 +141,7 @@ class EventListener:
 
                 if len(parts) == 2:
 
-                    info = json.loads(parts[1].decode('utf-8'))
+                    info = json.loads(parts[1])
 
                     if info['event_type'] == 'spike':
                         spike_callback(info)